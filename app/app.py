@@ -1,16 +1,23 @@
 import chainlit as cl
-from sentence_transformers import SentenceTransformer
 import torch
-import qdrant_client
-from langchain_together import ChatTogether
-from langchain_core.messages import HumanMessage
+from qdrant_client import grpc
+import redis.asyncio as redis
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain.prompts import PromptTemplate
+import orjson
 import logging
+import re
 import time
-from langdetect import detect
+import asyncio
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import cld3
 from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
 import os
 from typing import Optional, Dict
+from backends import get_encoder, get_qdrant_client, get_llm, get_warmup_llm
 
 # ----------------------------
 # Logging Configuration
@@ -28,21 +35,78 @@ def get_data_layer():
 # ----------------------------
 # Model & Client Initialization
 # ----------------------------
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-logger.info(f"Using device: {device}")
+model = get_encoder()
+client = get_qdrant_client()
+llama = get_llm()
+
+# ----------------------------
+# Warmup
+# ----------------------------
+# Pay the encoder's one-off costs (CUDA context, kernel selection, ORT session
+# setup) at boot rather than on the first user's query.
+def warmup_encoder():
+    start_time = time.time()
+    with torch.inference_mode():
+        model.encode(["warmup"] * 4, batch_size=4)
+    logger.info(f"Encoder warmup took {time.time() - start_time:.2f} seconds")
+
+
+warmup_encoder()
+
+# The LLM is warmed once, on Chainlit's event loop, through the same async
+# client that ainvoke/astream use, so the pooled connection it opens (and,
+# for Ollama, the model it loads into VRAM) is the one real requests reuse.
+_llm_warmup_task = None
+
+
+async def warmup_llm():
+    try:
+        start_time = time.time()
+        await get_warmup_llm().ainvoke("hi")
+        logger.info(f"LLM warmup took {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.warning(f"LLM warmup failed: {e}")
 
-model = SentenceTransformer('BAAI/bge-m3', device=device)
-client = qdrant_client.QdrantClient(os.environ["QDRANT_URL"], timeout=10.00)
-llama = ChatTogether(model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo", api_key=os.environ.get("TOGETHER_API_KEY"), max_retries=3)
+
+def ensure_llm_warmup():
+    global _llm_warmup_task
+    if _llm_warmup_task is None:
+        _llm_warmup_task = asyncio.get_running_loop().create_task(warmup_llm())
 
 # ----------------------------
 # Function: Language Detection & Translation
 # ----------------------------
-def detect_and_translate(text):
+# Languages that are searched as-is: English matches the collection, and
+# bge-m3 retrieves Indonesian queries against it well enough cross-lingually.
+# "und" (undetermined) covers predictions cld3 itself marks as unreliable.
+PASSTHROUGH_LANGUAGES = {"en", "id", "und"}
+INDONESIAN_STOPWORDS = re.compile(r"\b(yang|dan|apa|apakah|saya|penyakit|kulit)\b", re.IGNORECASE)
+TRANSLATION_CACHE_SIZE = 1024
+_translation_cache = OrderedDict()
+
+
+@lru_cache(maxsize=1024)
+def detect_language(text):
+    if INDONESIAN_STOPWORDS.search(text):
+        return "id"
+    # cld3 is a native extension, cheap enough to call inline on the event loop
+    prediction = cld3.get_language(text)
+    if prediction is None or not prediction.is_reliable:
+        # Typical for short questions; searching them as-is beats an LLM
+        # translation of a guessed language
+        return "und"
+    return prediction.language
+
+
+async def detect_and_translate(text):
+    cached = _translation_cache.get(text)
+    if cached is not None:
+        _translation_cache.move_to_end(text)
+        return cached
     try:
-        detected_lang = detect(text)
+        detected_lang = detect_language(text)
         logger.info(f"Detected language: {detected_lang}")
-        if detected_lang == "en":
+        if detected_lang in PASSTHROUGH_LANGUAGES:
             return text
         translation_prompt = f"""
             Translate the following sentence from {detected_lang} to English. Do not add explanation, just translate.
@@ -50,106 +114,416 @@ def detect_and_translate(text):
             Original ({detected_lang}): {text}
             English:
             """
-        response = llama.invoke(translation_prompt)
+        response = await llama.ainvoke(translation_prompt)
         translated = response.content.strip()
         if not translated:
             logger.warning("Translation result is empty. Returning original text.")
             return text
         logger.info(f"Translation result: {translated}")
+        _translation_cache[text] = translated
+        if len(_translation_cache) > TRANSLATION_CACHE_SIZE:
+            _translation_cache.popitem(last=False)
         return translated
     except Exception as e:
         logger.warning(f"Language detection or translation failed: {e}")
         return text
 
+# ----------------------------
+# Query Cache
+# ----------------------------
+class QueryCache:
+    """LRU cache of Qdrant results keyed by query embedding.
+
+    bge-m3 embeddings are L2-normalized, so a dot product against the cached
+    embeddings gives cosine similarity; anything at or above the threshold is
+    treated as the same question and served from the cache.
+    """
+
+    def __init__(self, max_size=2000, ttl_seconds=600, threshold=0.95, sweep_interval=60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        # Embeddings live in a preallocated matrix; each entry owns one row.
+        self._entries = OrderedDict()  # row -> (results, inserted_at), in LRU order
+        self._matrix = None
+        self._active = np.zeros(max_size, dtype=bool)
+        self._inserted_at = np.zeros(max_size, dtype=np.float64)
+        self._free_rows = []
+        self._used_rows = 0
+        self._last_sweep = time.time()
+        self._lock = threading.RLock()
+
+    def _evict(self, row):
+        del self._entries[row]
+        self._active[row] = False
+        self._free_rows.append(row)
+
+    def _evict_expired(self, now):
+        self._last_sweep = now
+        expired = [row for row, (_, ts) in self._entries.items() if now - ts > self.ttl_seconds]
+        for row in expired:
+            self._evict(row)
+
+    def get(self, embedding):
+        with self._lock:
+            if self._entries:
+                used = self._used_rows
+                scores = self._matrix[:used] @ embedding
+                # Expired rows must not win the argmax over a live match
+                live = self._active[:used] & (time.time() - self._inserted_at[:used] <= self.ttl_seconds)
+                scores[~live] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(best)
+                    self.hits += 1
+                    logger.info(f"Query cache hit (similarity {scores[best]:.3f}, hits={self.hits}, misses={self.misses})")
+                    return self._entries[best][0]
+            self.misses += 1
+            logger.info(f"Query cache miss (hits={self.hits}, misses={self.misses})")
+            return None
+
+    def put(self, embedding, results):
+        with self._lock:
+            now = time.time()
+            if now - self._last_sweep >= self.sweep_interval:
+                self._evict_expired(now)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_size, embedding.shape[0]), dtype=np.float32)
+
+            if self._free_rows:
+                row = self._free_rows.pop()
+            elif self._used_rows < self.max_size:
+                row = self._used_rows
+                self._used_rows += 1
+            else:
+                row = next(iter(self._entries))
+                self._evict(row)
+                self._free_rows.pop()
+
+            self._matrix[row] = embedding
+            self._active[row] = True
+            self._inserted_at[row] = now
+            self._entries[row] = (results, now)
+
+
+query_cache = QueryCache()
+
+# ----------------------------
+# Search Batcher
+# ----------------------------
+class SearchBatcher:
+    """Collects queries arriving within a short window and serves them together.
+
+    Each batch is encoded with a single model.encode call, checked against the
+    query cache, and the remaining misses are sent to Qdrant as one
+    search_batch request. The worker task is started lazily on the first call
+    so that it binds to Chainlit's running event loop.
+    """
+
+    def __init__(self, encoder, qdrant, cache, collection_name='Skin Diseases',
+                 limit=5, score_threshold=0.4, max_batch_size=32, max_wait=0.025):
+        self.encoder = encoder
+        self.qdrant = qdrant
+        self.cache = cache
+        self.collection_name = collection_name
+        self.limit = limit
+        self.score_threshold = score_threshold
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def search(self, text):
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Smart batching: sort by length so each batch pads as little as possible
+            batch.sort(key=lambda item: len(item[0]))
+            texts = [text for text, _ in batch]
+            try:
+                start_time = time.time()
+                vectors = await loop.run_in_executor(None, self._encode_batch, texts)
+                logger.info(f"Encoded batch of {len(texts)} queries in {time.time() - start_time:.2f} seconds")
+
+                results = [self.cache.get(vector) for vector in vectors]
+                misses = [i for i, res in enumerate(results) if res is None]
+                if misses:
+                    start_time = time.time()
+                    found = await loop.run_in_executor(None, self._search_batch, [vectors[i] for i in misses])
+                    logger.info(f"Qdrant search_batch of {len(misses)} queries took {time.time() - start_time:.2f} seconds")
+                    inserted = []
+                    for i, res in zip(misses, found):
+                        results[i] = res
+                        # Near-duplicates in one batch all miss; cache only the first
+                        if any(float(prev @ vectors[i]) >= self.cache.threshold for prev in inserted):
+                            continue
+                        self.cache.put(vectors[i], res)
+                        inserted.append(vectors[i])
+
+                for (_, future), res in zip(batch, results):
+                    if not future.done():
+                        future.set_result(res)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _encode_batch(self, texts):
+        # inference_mode is thread-local, so it is entered in the executor thread
+        with torch.inference_mode():
+            return self.encoder.encode(
+                texts,
+                batch_size=self.max_batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            ).astype(np.float32, copy=False)
+
+    def _search_batch(self, vectors):
+        # Build gRPC requests directly so the float32 rows go straight into the
+        # protobuf field, without a .tolist() copy or a REST model conversion.
+        return self.qdrant.search_batch(
+            collection_name=self.collection_name,
+            requests=[
+                grpc.SearchPoints(
+                    collection_name=self.collection_name,
+                    vector=vector,
+                    limit=self.limit,
+                    with_payload=grpc.WithPayloadSelector(enable=True),
+                    score_threshold=self.score_threshold
+                )
+                for vector in vectors
+            ]
+        )
+
+
+search_batcher = SearchBatcher(model, client, query_cache)
+
+# ----------------------------
+# Request Coalescing
+# ----------------------------
+# Identical requests that arrive while one is still running await the same
+# future instead of repeating the work (covers the window before the query
+# cache has been populated).
+_inflight = {}
+
+
+async def coalesce(key, factory, on_joined=None):
+    future = _inflight.get(key)
+    if future is not None:
+        logger.info("Joining in-flight request")
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise  # this caller itself was cancelled
+            # The leader's session was cancelled (e.g. the user pressed Stop);
+            # that must not propagate to other sessions, so run the work here.
+            logger.info("In-flight request was cancelled by its caller; retrying")
+            return await coalesce(key, factory, on_joined)
+        if on_joined is not None:
+            await on_joined(result)
+        return result
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await factory()
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved so an unawaited future doesn't log
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+    finally:
+        del _inflight[key]
+
 # ----------------------------
 # Function: Qdrant Search
 # ----------------------------
-def search(query):
+RESULT_FIELDS = ('question', 'answer', 'source', 'focus_area')
+RESULT_FORMAT = "Q: {}\nA: {}\nSource: {}\nFocus Area: {}"
+MAX_QUERY_CHARS = 2000
+
+
+async def search(query):
+    return await coalesce(("search", query), lambda: _search(query))
+
+
+async def _search(query):
     logger.info(f"Searching Qdrant for query: {query}")
     try:
         start_time = time.time()
 
-        query_vector = model.encode(query).tolist()
-        results = client.search(
-            collection_name='Skin Diseases',
-            query_vector=query_vector,
-            limit=5,
-            with_payload=True,
-            score_threshold=0.4
-        )
+        results = await search_batcher.search(query[:MAX_QUERY_CHARS])
 
         duration = time.time() - start_time
         logger.info(f"Qdrant search took {duration:.2f} seconds and found {len(results)} results")
 
-        final_results = []
-        for res in sorted(results, key=lambda x: x.score, reverse=True):
-            payload = res.payload
-            combined = f"Q: {payload.get('question', '')}\nA: {payload.get('answer', '')}\nSource: {payload.get('source', '')}\nFocus Area: {payload.get('focus_area', '')}"
-            final_results.append(combined.strip())
-        return final_results
+        # Qdrant already returns hits ordered by score
+        return [
+            RESULT_FORMAT.format(*(payload.get(k, '') for k in RESULT_FIELDS)).strip()
+            for payload in (res.payload for res in results)
+        ]
     except Exception as e:
         logger.error(f"Search failed: {e}")
         return []
 
+# ----------------------------
+# Response Prompt
+# ----------------------------
+# Parsed once at import; only the tone is substituted, and the resulting system
+# message is identical across turns so the provider can reuse its prompt cache.
+_RESPONSE_TEMPLATE = PromptTemplate(
+    input_variables=["tone"],
+    template="""
+Anda adalah chatbot kesehatan bernama C-Skin. Silakan jawab setiap pertanyaan pengguna dengan nada: {tone}.
+
+Petunjuk untuk menjawab pertanyaan terkait penyakit:
+- Jawablah hanya menggunakan informasi yang tersedia dalam konteks.
+- Jika pertanyaan berkaitan dengan penyakit, berikan informasi yang akurat, ringkas, dan lengkap berdasarkan konteks.
+- Jika tidak ditemukan informasi yang relevan dalam konteks, jangan berspekulasi atau mengarang jawaban. Sebagai gantinya, balas dengan: "Ini adalah semua informasi yang saya miliki."
+- Hindari penggunaan istilah medis yang rumit atau tidak umum. Gunakan bahasa yang sederhana dan mudah dipahami oleh masyarakat umum.
+- Selalu awali jawaban Anda dengan: "Terima kasih telah berkonsultasi dengan C-Skin."
+- Selalu akhiri jawaban Anda dengan: "Semoga informasi ini bermanfaat, lekas sembuh, dan terima kasih."
+- Jangan gunakan pengetahuan di luar konteks yang diberikan.
+- Jangan menyebutkan bahwa Anda terbatas oleh konteks — cukup berikan jawaban sesuai informasi yang tersedia.
+- Anda tidak boleh menyimpulkan atau menambahkan fakta yang tidak disebutkan secara eksplisit dalam konteks. Hanya merangkum atau mengungkapkan ulang apa yang memang ada.
+- Hanya gunakan informasi yang ada di dalam Database.
+- Hanya memberikan jawaban tentang penyakit kulit.
+- Gunakan hanya konteks yang diberikan pengguna untuk menjawab pertanyaan. Jika konteks tidak sesuai dengan pertanyaan, jangan menggunakan konteks tersebut.
+
+Jawab hanya dalam Bahasa Indonesia.
+""".strip()
+)
+
+
+@lru_cache(maxsize=8)
+def get_system_prompt(tone):
+    return _RESPONSE_TEMPLATE.format(tone=tone)
+
+
 # ----------------------------
 # Function: Generate Response
 # ----------------------------
-def generate_response(context, query, tone="professional and friendly"):
+async def generate_response(context, query, msg, tone="professional and friendly"):
+    key = ("generate", tuple(context), query, tone)
+    # When joining another caller's generation, it streamed into its own
+    # message, so replay the finished text into ours
+    return await coalesce(
+        key,
+        lambda: _generate_response(context, query, msg, tone),
+        on_joined=msg.stream_token
+    )
+
+
+async def _generate_response(context, query, msg, tone):
     try:
         start_time = time.time()
 
         # Gabungkan dokumen konteks menjadi teks
-        context_text = "\n\n".join([f"Doc {i+1}:\n{ctx.strip()}" for i, ctx in enumerate(context)])
-
-        # Template untuk prompt
-        prompt_template = PromptTemplate(
-            input_variables=["context", "query", "tone"],
-            template=""" 
-    Anda adalah chatbot kesehatan bernama C-Skin. Silakan jawab setiap pertanyaan pengguna dengan nada: {tone}.
-
-    Petunjuk untuk menjawab pertanyaan terkait penyakit:
-    - Jawablah hanya menggunakan informasi yang tersedia dalam konteks.
-    - Jika pertanyaan berkaitan dengan penyakit, berikan informasi yang akurat, ringkas, dan lengkap berdasarkan konteks.
-    - Jika tidak ditemukan informasi yang relevan dalam konteks, jangan berspekulasi atau mengarang jawaban. Sebagai gantinya, balas dengan: "Ini adalah semua informasi yang saya miliki."
-    - Hindari penggunaan istilah medis yang rumit atau tidak umum. Gunakan bahasa yang sederhana dan mudah dipahami oleh masyarakat umum.
-    - Selalu awali jawaban Anda dengan: "Terima kasih telah berkonsultasi dengan C-Skin."
-    - Selalu akhiri jawaban Anda dengan: "Semoga informasi ini bermanfaat, lekas sembuh, dan terima kasih."
-    - Jangan gunakan pengetahuan di luar konteks yang diberikan.
-    - Jangan menyebutkan bahwa Anda terbatas oleh konteks — cukup berikan jawaban sesuai informasi yang tersedia.
-    - Anda tidak boleh menyimpulkan atau menambahkan fakta yang tidak disebutkan secara eksplisit dalam konteks. Hanya merangkum atau mengungkapkan ulang apa yang memang ada.
-    - Hanya gunakan informasi yang ada di dalam Database.
-    - Hanya memberikan jawaban tentang penyakit kulit.
-
-    Gunakan hanya konteks berikut untuk menjawab pertanyaan pengguna:
-    {context}
-    Jika {context} tidak sesuai dengan pertanyaan, jangan menggunakan context tersebut.
-
-    Pertanyaan Pengguna:
-    {query}
-
-    Jawab hanya dalam Bahasa Indonesia.
-    """
-        )
+        context_text = "\n\n".join(ctx.strip() for ctx in context)
 
-        formatted_prompt = prompt_template.format(context=context_text, query=query, tone=tone)
-        messages = [HumanMessage(content=formatted_prompt)]
+        messages = [
+            SystemMessage(content=get_system_prompt(tone)),
+            HumanMessage(content=f"Konteks:\n{context_text}\n\nPertanyaan:\n{query}")
+        ]
 
-        response = llama.invoke(messages)
-        output = response.content.strip()
+        # Stream tokens into the Chainlit message as they arrive
+        chunks = []
+        async for chunk in llama.astream(messages):
+            if chunk.content:
+                chunks.append(chunk.content)
+                await msg.stream_token(chunk.content)
+        output = "".join(chunks).strip()
 
         logger.info(f"LLM response generation took {time.time() - start_time:.2f} seconds")
         logger.info(f"Generated response preview: {output[:100]}...")
-        return output.strip()
+        return output
 
     except Exception as e:
         logger.error(f"LLM response generation failed: {e}")
-        return "Terjadi kesalahan saat menghasilkan jawaban. Silakan coba lagi."
+        msg.content = "Terjadi kesalahan saat menghasilkan jawaban. Silakan coba lagi."
+        return msg.content
 
 # ----------------------------
-# Async Wrappers
+# Chat History
 # ----------------------------
-search_async = cl.make_async(search)
-generate_response_async = cl.make_async(generate_response)
+# The session only keeps a short window (a plain list, since Chainlit persists
+# user_session into thread metadata as JSON); the full transcript is mirrored
+# to Redis (when configured) so long chats don't grow the in-memory session.
+HISTORY_WINDOW = 20
+HISTORY_MAX_STORED = 1000
+redis_client = redis.from_url(os.environ["REDIS_URL"]) if os.environ.get("REDIS_URL") else None
+
+
+def get_history():
+    history = cl.user_session.get("history")
+    if history is None:
+        history = []
+        cl.user_session.set("history", history)
+    return history
+
+
+async def record_turn(role, text):
+    entry = {"role": role, "text": text}
+    history = get_history()
+    history.append(entry)
+    del history[:-HISTORY_WINDOW]
+    if redis_client is None:
+        return
+    thread_id = cl.context.session.thread_id
+    try:
+        key = f"chat:{thread_id}"
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, orjson.dumps(entry))
+            pipe.ltrim(key, 0, HISTORY_MAX_STORED - 1)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to persist chat history for thread {thread_id}: {e}")
+
+
+async def load_history(thread):
+    thread_id = thread.get("id")
+    history = []
+    if redis_client is not None:
+        try:
+            # LPUSH stores newest first, so the tail of the chat is the head of the list
+            entries = await redis_client.lrange(f"chat:{thread_id}", 0, HISTORY_WINDOW - 1)
+            history = [orjson.loads(entry) for entry in reversed(entries)]
+        except Exception as e:
+            logger.warning(f"Failed to load chat history for thread {thread_id}: {e}")
+    if not history:
+        # Without Redis, use the session history Chainlit already restored from the thread
+        history = list(cl.user_session.get("history") or [])[-HISTORY_WINDOW:]
+    cl.user_session.set("history", history)
+    return history
 
 # ----------------------------
 # OAuth / Login
@@ -165,6 +539,13 @@ def oauth_callback(provider_id: str, token: str, raw_user_data: Dict[str, str],
         logger.error(f"OAuth callback error: {e}")
         return None
 
+# ----------------------------
+# Chat Start Handler
+# ----------------------------
+@cl.on_chat_start
+async def on_chat_start():
+    ensure_llm_warmup()
+
 # ----------------------------
 # Chat Handler
 # ----------------------------
@@ -174,23 +555,30 @@ async def main(message: cl.Message):
         logger.info("Handling user message")
 
         original_query = message.content
-        query = await cl.make_async(detect_and_translate)(original_query)
+
+        # bge-m3 is multilingual, so search with the original text while the
+        # translation is in flight and only search again if it changed the query.
+        query, results = await asyncio.gather(
+            detect_and_translate(original_query),
+            search(original_query)
+        )
         logger.info(f"Translated query: {query}")
+        if query != original_query:
+            results = await search(query)
 
-        history = cl.user_session.get("history", [])
-        history.append({"role": "user", "text": original_query})
+        await record_turn("user", original_query)
 
-        results = await search_async(query)
         if not results:
             await cl.Message(content="Tidak ditemukan informasi yang relevan.", author="C-Skin Chatbot").send()
             return
 
-        response = await generate_response_async(results, query)
+        msg = cl.Message(content="", author="C-Skin Chatbot")
+        await msg.send()
 
-        history.append({"role": "assistant", "text": response})
-        cl.user_session.set("history", history)
+        response = await generate_response(results, query, msg)
+        await msg.update()
 
-        await cl.Message(content=response, author="C-Skin Chatbot").send()
+        await record_turn("assistant", response)
 
     except Exception as e:
         logger.error(f"Unexpected error in main handler: {e}")
@@ -202,6 +590,7 @@ async def main(message: cl.Message):
 @cl.on_chat_resume
 async def on_chat_resume(thread):
     logger.info("Chat resumed")
+    ensure_llm_warmup()
 
     if thread is None or not isinstance(thread, dict):
         logger.warning("Invalid or missing thread. Resetting history.")
@@ -209,7 +598,8 @@ async def on_chat_resume(thread):
         await cl.Message(content="Selamat datang kembali di C-Skin!").send()
         return
 
-    history = cl.user_session.get("history", [])
+    history = await load_history(thread)
+    logger.info(f"Restored {len(history)} history entries")
     for msg in history:
         if msg["role"] == "assistant":
             await cl.Message(content=msg["text"], author="C-Skin Chatbot").send()
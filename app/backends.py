@@ -0,0 +1,199 @@
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Pooling
+import torch
+import qdrant_client
+import httpx
+import numpy as np
+import logging
+import os
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Device
+# ----------------------------
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+# ----------------------------
+# HTTP Clients
+# ----------------------------
+# Shared keep-alive pools so each request reuses an open HTTP/2 connection
+# instead of paying a fresh TCP+TLS handshake.
+http_limits = httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0)
+http_timeout = httpx.Timeout(300.0, connect=10.0)
+
+
+@lru_cache(maxsize=1)
+def get_http_client():
+    return httpx.Client(
+        transport=httpx.HTTPTransport(http2=True, retries=3, limits=http_limits),
+        timeout=http_timeout
+    )
+
+
+@lru_cache(maxsize=1)
+def get_http_async_client():
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(http2=True, retries=3, limits=http_limits),
+        timeout=http_timeout
+    )
+
+# ----------------------------
+# Encoder
+# ----------------------------
+def upcast_pooling(st_model):
+    """Run pooling (and the Normalize module after it) in FP32 on a bf16 encoder."""
+    for module in st_model.modules():
+        if isinstance(module, Pooling):
+            pooling_forward = module.forward
+
+            def forward(features, _forward=pooling_forward):
+                features["token_embeddings"] = features["token_embeddings"].float()
+                return _forward(features)
+
+            module.forward = forward
+
+
+class OnnxEncoder:
+    """ONNX Runtime drop-in for the parts of SentenceTransformer.encode used here.
+
+    Expects a directory produced by one of:
+        # CPU (optionally followed by ORTQuantizer dynamic INT8 quantization)
+        optimum-cli export onnx --model BAAI/bge-m3 --task feature-extraction --optimize O3 bge-m3-onnx/
+        # CUDA: O4 emits an fp16 graph and needs the onnxruntime-gpu wheel
+        optimum-cli export onnx --model BAAI/bge-m3 --task feature-extraction --optimize O4 --device cuda bge-m3-onnx/
+    Uses CLS pooling like bge-m3's dense head so vectors match the existing
+    collection.
+    """
+
+    def __init__(self, model_dir, device='cpu'):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if device == 'cuda' else ['CPUExecutionProvider']
+        available = ort.get_available_providers()
+        missing = [p for p in providers if p not in available]
+        if missing:
+            logger.warning(f"ONNX Runtime providers not available: {missing} (install onnxruntime-gpu for CUDA)")
+        model_path = os.path.join(model_dir, os.environ.get("ONNX_MODEL_FILE", "model.onnx"))
+        self.session = ort.InferenceSession(model_path, providers=[p for p in providers if p in available])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_seq_length = 8192
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        embeddings = []
+        for i in range(0, len(sentences), batch_size):
+            tokens = self.tokenizer(
+                sentences[i:i + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            inputs = {k: v.astype(np.int64) for k, v in tokens.items() if k in self.input_names}
+            last_hidden_state = self.session.run(None, inputs)[0]
+            embeddings.append(last_hidden_state[:, 0].astype(np.float32))
+
+        embeddings = np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        return embeddings[0] if single else embeddings
+
+
+@lru_cache(maxsize=1)
+def get_encoder():
+    logger.info(f"Using device: {device}")
+    if device == 'cpu':
+        torch.set_num_threads(min(os.cpu_count() or 1, 8))
+        try:
+            torch.set_num_interop_threads(2)
+        except RuntimeError:
+            # Can only be set once per process; Chainlit's -w reload re-imports
+            # this module with a fresh cache, so the second call lands here.
+            pass
+        logger.info(f"Using {torch.get_num_threads()} intra-op threads")
+
+    onnx_model_dir = os.environ.get("ONNX_MODEL_DIR")
+    if onnx_model_dir:
+        model = OnnxEncoder(onnx_model_dir, device=device)
+        logger.info(f"Loaded ONNX Runtime encoder from {onnx_model_dir}")
+    else:
+        model = SentenceTransformer('BAAI/bge-m3', device=device)
+        model.eval()
+    if not onnx_model_dir and device == 'cuda' and torch.cuda.is_bf16_supported(including_emulation=False):
+        model = model.to(dtype=torch.bfloat16)
+        upcast_pooling(model)
+        logger.info("Loaded encoder in bfloat16")
+
+    # Chat queries are short; capping the sequence length keeps a pasted
+    # paragraph from paying for bge-m3's 8192-token default.
+    model.max_seq_length = 128
+    return model
+
+# ----------------------------
+# Qdrant
+# ----------------------------
+@lru_cache(maxsize=1)
+def get_qdrant_client():
+    return qdrant_client.QdrantClient(
+        os.environ["QDRANT_URL"],
+        timeout=10.00,
+        prefer_grpc=True,
+        grpc_port=int(os.environ.get("QDRANT_GRPC_PORT", 6334)),
+        http2=True,
+        limits=http_limits
+    )
+
+# ----------------------------
+# LLM
+# ----------------------------
+# Per-backend option that limits a completion to a single token (langchain_ollama
+# takes per-call model options through `options` rather than as top-level kwargs)
+_ONE_TOKEN_KWARGS = {
+    "ollama": {"options": {"num_predict": 1}},
+    "together": {"max_tokens": 1},
+}
+
+
+def get_llm_backend():
+    return os.environ.get("LLM_BACKEND", "together").lower()
+
+
+@lru_cache(maxsize=1)
+def get_llm():
+    """Return the chat model selected by LLM_BACKEND ("together" or "ollama")."""
+    backend = get_llm_backend()
+    logger.info(f"Using LLM backend: {backend}")
+
+    if backend == "ollama":
+        from langchain_ollama import ChatOllama
+
+        return ChatOllama(
+            base_url=os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434"),
+            model=os.environ.get("OLLAMA_MODEL", "llama3.1:8b"),
+            keep_alive=-1
+        )
+
+    if backend == "together":
+        from langchain_together import ChatTogether
+
+        return ChatTogether(
+            model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+            api_key=os.environ.get("TOGETHER_API_KEY"),
+            max_retries=3,
+            http_client=get_http_client(),
+            http_async_client=get_http_async_client()
+        )
+
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+
+
+def get_warmup_llm():
+    """Return the configured chat model bound to generate a single token."""
+    return get_llm().bind(**_ONE_TOKEN_KWARGS[get_llm_backend()])